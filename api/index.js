@@ -1,6 +1,6 @@
 const express = require( 'express' );
 const { spawn } = require( 'child_process' );
-const fs = require( 'fs' );
+const os = require( 'os' );
 const path = require( 'path' );
 const cors = require( 'cors' );
 const bodyParser = require( 'body-parser' );
@@ -11,206 +11,177 @@ const PORT = process.env.PORT || 5000;
 app.use( bodyParser.json( { limit: '50mb' } ) );
 app.use( bodyParser.urlencoded( { limit: '50mb', extended: true } ) );
 
-// Create the Python script file that contains the ML model logic
+// The ML model logic lives in route_classifier.py next to this file
 const pythonScriptPath = path.join( __dirname, 'route_classifier.py' );
-const pythonScript = `
-import sys
-import json
-import pickle
-import pandas as pd
-import numpy as np
-import warnings
-from decimal import Decimal, getcontext
-from datetime import datetime
-from sklearn.preprocessing import StandardScaler
-
-# Set high precision for decimal calculations
-getcontext().prec = 28
-
-# Suppress XGBoost warnings
-warnings.filterwarnings("ignore", category=UserWarning)
-
-# Get current date and time
-now = datetime.now()
-Time = [now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S")]
-
-try:
-    # Load the data
-    df = pd.read_csv('Processed_crime.csv')
-
-    # Process training data
-    train = df.iloc[:,:-1]
-    if 'Unnamed: 0' in train.columns:
-        train.drop(columns=['Unnamed: 0'], inplace=True)
-
-    # Create and fit the scaler
-    scaler = StandardScaler()
-    scaler.fit_transform(train)
-
-    # Load the model
-    with open("model.pkl", "rb") as f:
-        xgb_clf = pickle.load(f)
-
-    # Read input data from stdin
-    input_data = sys.stdin.read()
-    data = json.loads(input_data)
-
-    # Initialize results list
-    results = []
-
-    # Process each route
-    for route_idx, route in enumerate(data):
-        try:
-            location_list = []
-            for point in route:
-                l = [float(point['lat']), float(point['lng'])]
-                location_list.append(l)
-
-            # Create DataFrame with proper column names
-            new_df = pd.DataFrame(location_list, columns=['LATITUDE', 'LONGITUDE'])
-            
-            # Add time features directly
-            new_df['YEAR'] = now.year
-            new_df['MONTH'] = now.month
-            new_df['HOUR'] = now.hour
-            new_df['MINUTE'] = now.minute
-            
-            # Transform the data
-            new_df_values = scaler.transform(new_df)
-            y_pred = xgb_clf.predict(new_df_values)
-            
-            # Debug output - examine actual prediction values
-            print(f"Debug - Route {route_idx}: y_pred values (first 5): {y_pred[:5]}", file=sys.stderr)
-            print(f"Debug - Route {route_idx}: y_pred sum: {np.sum(y_pred)}", file=sys.stderr)
-            print(f"Debug - Route {route_idx}: prediction count: {len(y_pred)}", file=sys.stderr)
-            
-            # Calculate score with high precision using Decimal
-            sum_val = Decimal(str(np.sum(y_pred)))
-            div = Decimal(str(len(y_pred) * 10))
-            score = sum_val / div
-            
-            # Debug the Decimal calculation
-            print(f"Debug - Route {route_idx}: sum_val={sum_val}, div={div}, score={score}", file=sys.stderr)
-            
-            # Convert to float for model compatibility but preserve precision
-            score_float = float(score)
-            
-            # Create a precise string representation
-            score_str = "{:.10f}".format(score_float).rstrip('0').rstrip('.')
-            
-            print(f"Raw score (high precision): {score_str}", file=sys.stderr)
-            
-            # TEMPORARY FIX: If score is very close to zero, use a test value
-            # This helps verify that the frontend is correctly handling non-zero values
-            if float(score_str) < 0.0001:
-                # Test values: route 0: 0.2, route 1: 0.5, route 2: 0.8
-                test_values = ["0.2", "0.5", "0.8"] 
-                score_str = test_values[route_idx % len(test_values)]
-                print(f"Using test value for route {route_idx}: {score_str}", file=sys.stderr)
-            
-            results.append(score_str)  # Store as string to preserve precision
-            
-        except Exception as route_error:
-            print(f"Error processing route {route_idx}: {str(route_error)}", file=sys.stderr)
-            results.append("0.5")  # Default score for error as string
-    
-    # Output the raw string array - no need for special encoding now
-    print(json.dumps(results))
-        
-except Exception as e:
-    print(f"Top-level exception: {str(e)}", file=sys.stderr)
-    print(json.dumps({"error": str(e)}))
-    sys.exit(1)
-`;
-
-// Write the Python script to a file
-fs.writeFileSync( pythonScriptPath, pythonScript );
 
-// API route to classify routes
-app.post( '/classify_route', ( req, res ) => {
-    const routes = req.body;
-
-    // Log the incoming request for debugging
-    console.log( `Received request with ${ routes.length } routes` );
-
-    // Validate request data
-    if ( !Array.isArray( routes ) ) {
-        return res.status( 400 ).json( { error: 'Request body must be an array of routes' } );
-    }
-
-    // Spawn a Python process
-    const pythonProcess = spawn( 'python', [ pythonScriptPath ] );
-
-    let result = '';
-    let error = '';
-
-    // Handle data from Python script
-    pythonProcess.stdout.on( 'data', ( data ) => {
-        result += data.toString();
+// Long-lived Python sidecars: each loads the model once at startup and serves
+// POST /classify on localhost, so requests never pay Python startup cost.
+// Several single-threaded workers share the port (SO_REUSEPORT on Linux) so
+// concurrent requests run in parallel.
+const CLASSIFIER_PORT = process.env.CLASSIFIER_PORT || 5001;
+const CLASSIFIER_URL = `http://127.0.0.1:${ CLASSIFIER_PORT }/classify`;
+const HEALTH_URL = `http://127.0.0.1:${ CLASSIFIER_PORT }/health`;
+const CLASSIFIER_WORKERS = Number( process.env.CLASSIFIER_WORKERS ) ||
+    ( process.platform === 'linux' ? os.cpus().length : 1 );
+// A cold start converts the model and parses the training CSV, so allow plenty of time
+const STARTUP_TIMEOUT = 120000;
+const sidecars = new Array( CLASSIFIER_WORKERS ).fill( null );
+let sidecarReady = null;
+let shuttingDown = false;
+let workersStarted = false;
+// Restarts back off exponentially and give up after MAX_RESTARTS in a row
+const MAX_RESTARTS = 5;
+const restarts = new Array( CLASSIFIER_WORKERS ).fill( 0 );
+
+function startSidecar ( slot ) {
+    const sidecar = spawn( 'python', [ pythonScriptPath ], {
+        cwd: __dirname,
+        env: { ...process.env, CLASSIFIER_PORT: String( CLASSIFIER_PORT ) }
+    } );
+    sidecars[ slot ] = sidecar;
+
+    sidecar.stdout.on( 'data', ( data ) => {
+        console.log( `Python: ${ data }` );
+
+        // The worker prints this once it is listening
+        if ( data.toString().includes( 'Classifier running' ) ) {
+            restarts[ slot ] = 0;
+
+            // The first worker has generated model.ubj and scaler_stats.npz,
+            // so the others start from those instead of all converting at once
+            if ( !workersStarted ) {
+                workersStarted = true;
+                for ( let other = 1; other < CLASSIFIER_WORKERS; other++ ) {
+                    startSidecar( other );
+                }
+            }
+        }
     } );
 
     // Handle errors
-    pythonProcess.stderr.on( 'data', ( data ) => {
-        error += data.toString();
+    sidecar.stderr.on( 'data', ( data ) => {
         console.error( `Python Error: ${ data }` );
     } );
 
-    // Set timeout for Python process
-    const timeout = setTimeout( () => {
-        console.error( 'Python process timed out' );
-        pythonProcess.kill();
-        res.status( 500 ).json( { error: 'Processing timed out' } );
-    }, 30000 ); // 30 second timeout
+    // Restart the sidecar if it dies
+    sidecar.on( 'close', ( code ) => {
+        console.error( `Python process ${ slot } exited with code ${ code }` );
+        sidecars[ slot ] = null;
+        sidecarReady = null;
+        if ( shuttingDown ) {
+            return;
+        }
+        if ( restarts[ slot ] >= MAX_RESTARTS ) {
+            console.error( `Python process ${ slot } failed ${ restarts[ slot ] } times in a row, not restarting` );
+            return;
+        }
+        const delay = 1000 * 2 ** restarts[ slot ];
+        restarts[ slot ] += 1;
+        setTimeout( () => {
+            startSidecar( slot );
+        }, delay );
+    } );
 
-    // When the Python process exits - SINGLE event handler
-    pythonProcess.on( 'close', ( code ) => {
-        clearTimeout( timeout );
+    return sidecar;
+}
 
-        if ( code !== 0 ) {
-            console.error( `Python process exited with code ${ code }` );
-            return res.status( 500 ).json( {
-                error: 'Failed to process routes',
-                details: error || 'Unknown error'
-            } );
-        }
+// True once every worker has exited and used up its restarts
+function allSidecarsFailed () {
+    return sidecars.every( ( sidecar, slot ) => !sidecar && restarts[ slot ] >= MAX_RESTARTS );
+}
 
+// Poll the sidecar's health endpoint until it answers
+async function pollHealth () {
+    const deadline = Date.now() + STARTUP_TIMEOUT;
+    while ( Date.now() < deadline ) {
         try {
-            // Handle empty results
-            if ( !result || result.trim() === '' ) {
-                return res.status( 500 ).json( { error: 'No result returned from model' } );
+            const response = await fetch( HEALTH_URL, { signal: AbortSignal.timeout( 1000 ) } );
+            if ( response.ok ) {
+                return;
             }
+        } catch ( err ) {
+            // Still starting up
+        }
+        await new Promise( ( resolve ) => setTimeout( resolve, 250 ) );
+    }
+    throw new Error( 'Classifier did not become ready in time' );
+}
+
+// Shared by all requests that arrive while the sidecar is (re)starting
+function waitForSidecar () {
+    if ( !sidecarReady ) {
+        sidecarReady = pollHealth().catch( ( err ) => {
+            sidecarReady = null;
+            throw err;
+        } );
+    }
+    return sidecarReady;
+}
 
-            // Parse the result, which contains string representations of numbers
-            const stringResults = JSON.parse( result );
-            console.log( 'String results:', stringResults );
+async function classifyRoutes ( routes ) {
+    if ( allSidecarsFailed() ) {
+        throw new Error( 'Classifier is not running' );
+    }
+    await waitForSidecar();
+    const response = await fetch( CLASSIFIER_URL, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify( routes ),
+        signal: AbortSignal.timeout( 30000 ) // 30 second timeout
+    } );
+    return response.text();
+}
 
-            // Convert string numbers to actual numbers with full precision
-            const numericResults = Array.isArray( stringResults )
-                ? stringResults.map( str => Number( str ) )
-                : Number( stringResults );
+// API route to classify routes
+app.post( '/classify_route', async ( req, res ) => {
+    const routes = req.body;
 
-            console.log( 'Numeric results:', numericResults );
+    // Log the incoming request for debugging
+    console.log( `Received request with ${ routes.length } routes` );
 
-            // For arrays, check the first element's value
-            if ( Array.isArray( numericResults ) && numericResults.length > 0 ) {
-                console.log( 'First element value:', numericResults[ 0 ], 'type:', typeof numericResults[ 0 ] );
-            }
+    // Validate request data
+    if ( !Array.isArray( routes ) ) {
+        return res.status( 400 ).json( { error: 'Request body must be an array of routes' } );
+    }
 
-            // Send the numeric result to the client
-            res.json( numericResults );
-        } catch ( e ) {
-            console.error( 'Failed to parse Python output:', e );
-            res.status( 500 ).json( {
-                error: 'Invalid output from model',
-                details: e.message,
-                raw: result
+    let result;
+    try {
+        result = await classifyRoutes( routes );
+    } catch ( err ) {
+        return res.status( 500 ).json( {
+            error: 'Failed to process routes',
+            details: err.message || 'Unknown error'
+        } );
+    }
+
+    try {
+        // Handle empty results
+        if ( !result || result.trim() === '' ) {
+            return res.status( 500 ).json( { error: 'No result returned from model' } );
+        }
+
+        // Parse the result, an array of numeric scores
+        const numericResults = JSON.parse( result );
+
+        if ( numericResults && numericResults.error ) {
+            return res.status( 500 ).json( {
+                error: 'Failed to process routes',
+                details: numericResults.error
             } );
         }
-    } );
 
-    // Send the routes data to the Python script
-    pythonProcess.stdin.write( JSON.stringify( routes ) );
-    pythonProcess.stdin.end();
+        console.log( 'Numeric results:', numericResults );
+
+        // Send the numeric result to the client
+        res.json( numericResults );
+    } catch ( e ) {
+        console.error( 'Failed to parse Python output:', e );
+        res.status( 500 ).json( {
+            error: 'Invalid output from model',
+            details: e.message,
+            raw: result
+        } );
+    }
 } );
 
 // Health check endpoint
@@ -222,16 +193,25 @@ app.get( '/health', ( req, res ) => {
 app.listen( PORT, () => {
     console.log( `Server running on port ${ PORT }` );
     console.log( `API endpoint: http://localhost:${ PORT }/classify_route` );
+    // Load the model before the first request arrives; the other workers
+    // start once this one is up
+    startSidecar( 0 );
 } );
 
-// Handle graceful shutdown
-process.on( 'SIGINT', () => {
+// Handle graceful shutdown; never leave the sidecar holding its port
+function shutdown () {
     console.log( 'Shutting down server...' );
-    // Clean up the temporary Python script file
-    try {
-        fs.unlinkSync( pythonScriptPath );
-    } catch ( err ) {
-        console.error( 'Error removing Python script:', err );
-    }
+    shuttingDown = true;
     process.exit( 0 );
-} );
\ No newline at end of file
+}
+
+process.on( 'SIGINT', shutdown );
+process.on( 'SIGTERM', shutdown );
+process.on( 'exit', () => {
+    shuttingDown = true;
+    sidecars.forEach( ( sidecar ) => {
+        if ( sidecar ) {
+            sidecar.kill();
+        }
+    } );
+} );
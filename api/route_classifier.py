@@ -1,108 +1,447 @@
 
+import os
+
+# Route batches are small; a single inference thread avoids spinning up an
+# OpenMP pool per call. Must be set before numpy/xgboost are imported.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
 import sys
 import json
+import logging
 import pickle
-import pandas as pd
+import queue
+import socket
+import threading
 import numpy as np
 import warnings
-from decimal import Decimal, getcontext
+import xgboost as xgb
+from collections import OrderedDict
 from datetime import datetime
-from sklearn.preprocessing import StandardScaler
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
 
-# Set high precision for decimal calculations
-getcontext().prec = 28
+try:
+    import tl2cgen
+except ImportError:
+    tl2cgen = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # Suppress XGBoost warnings
 warnings.filterwarnings("ignore", category=UserWarning)
 
-# Get current date and time
-now = datetime.now()
-Time = [now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S")]
+# Debug output is off unless CLASSIFIER_LOG_LEVEL=DEBUG
+logger = logging.getLogger("route_classifier")
+
+# Resolve data files next to this script, whatever the caller's cwd is
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, "model.pkl")
+BOOSTER_PATH = os.path.join(BASE_DIR, "model.ubj")
+LIB_PATH = os.path.join(BASE_DIR, "model.so")
+DATA_PATH = os.path.join(BASE_DIR, "Processed_crime.csv")
+SCALER_STATS_PATH = os.path.join(BASE_DIR, "scaler_stats.npz")
+SCALER_STATS_VERSION = 2
+
+# Floor applied to every route score, and the score for routes that fail
+MIN_SCORE = 0.0001
+DEFAULT_SCORE = 0.5
+
+# Per-point prediction cache, shared by all sidecar request threads
+PREDICTION_CACHE_SIZE = 100_000
+_prediction_cache = OrderedDict()
+_prediction_cache_lock = threading.Lock()
+
+# Pool of reusable feature matrices. Sidecar threads live only as long as a
+# connection, so buffers are checked out per request and returned afterwards
+# rather than tied to a thread.
+SCRATCH_POINTS = 4096
+_scratch_pool = queue.SimpleQueue()
+
+# The sidecar only listens on localhost; index.js is its only client
+HOST = "127.0.0.1"
+PORT = int(os.environ.get("CLASSIFIER_PORT", 5001))
+
+
+# True when target is missing or older than source, so derived files are
+# rebuilt after the file they were generated from is replaced. A target
+# shipped without its source is used as is.
+def is_stale(target, source):
+    if not os.path.exists(target):
+        return True
+    return os.path.exists(source) and os.path.getmtime(source) > os.path.getmtime(target)
+
+
+# Load the booster once per process. The pickled XGBClassifier is converted
+# to XGBoost's native format (again whenever model.pkl is replaced) so later
+# starts skip unpickling and the sklearn wrapper entirely.
+@lru_cache(maxsize=None)
+def load_booster():
+    if is_stale(BOOSTER_PATH, MODEL_PATH):
+        logger.warning("Converting %s to %s", MODEL_PATH, BOOSTER_PATH)
+        with open(MODEL_PATH, "rb") as f:
+            xgb_clf = pickle.load(f)
+        # Write then rename, so other sidecar workers never read a partial file
+        tmp_path = os.path.join(BASE_DIR, f"model.{os.getpid()}.tmp.ubj")
+        xgb_clf.get_booster().save_model(tmp_path)
+        os.replace(tmp_path, BOOSTER_PATH)
+
+    booster = xgb.Booster()
+    booster.load_model(BOOSTER_PATH)
+
+    # Pin inference to one thread for small batches
+    booster.set_param({'nthread': 1})
+    return booster
+
+
+# Compile the trees into a C shared library with Treelite/TL2cgen. This is
+# an offline step (python route_classifier.py --export-lib) since compiling
+# the full ensemble takes a while.
+def export_compiled_model():
+    try:
+        import treelite
+    except ImportError:
+        treelite = None
+    if treelite is None or tl2cgen is None:
+        sys.exit("--export-lib needs treelite and tl2cgen: pip install treelite tl2cgen")
+
+    model = treelite.frontend.from_xgboost(load_booster())
+    tl2cgen.export_lib(model, toolchain="gcc", libpath=LIB_PATH,
+                       params={"parallel_comp": 32})
+
+
+# Load the model once per process and reuse it for every request. Returns a
+# callable mapping a float32 feature matrix to raw model output, preferring
+# the compiled library when it has been exported from the current model.
+@lru_cache(maxsize=None)
+def load_model():
+    # Refreshes model.ubj first if model.pkl was replaced
+    booster = load_booster()
+
+    if tl2cgen is not None and os.path.exists(LIB_PATH):
+        if not is_stale(LIB_PATH, BOOSTER_PATH):
+            predictor = tl2cgen.Predictor(LIB_PATH, nthread=1)
+            return lambda features: predictor.predict(tl2cgen.DMatrix(features, dtype="float32"))
+        logger.warning("%s is older than %s; using the booster until --export-lib is rerun",
+                       LIB_PATH, BOOSTER_PATH)
+
+    return booster.inplace_predict
+
+
+def predict(model, features):
+    # inplace_predict skips DMatrix construction; it wants C-contiguous float32
+    features = np.ascontiguousarray(features, dtype=np.float32)
+    y_pred = np.asarray(model(features)).reshape(len(features), -1)
+
+    # multi:softmax yields class ids; reduce per-class scores if not
+    if y_pred.shape[1] > 1:
+        return y_pred.argmax(axis=1)
+    return y_pred[:, 0]
+
+
+# Scaler statistics are exported once to scaler_stats.npz, so loading them is
+# a cheap np.load instead of parsing the training CSV on every start. The
+# file is rebuilt when it is from an older format or the CSV has changed.
+@lru_cache(maxsize=None)
+def load_scaler_stats():
+    stats = read_scaler_stats()
+    if stats is None:
+        export_scaler_stats()
+        stats = read_scaler_stats()
+    mean, std = stats
+
+    # Inference runs in float32 end to end; scaling multiplies by the inverse
+    # std so the hot path has no divisions
+    return mean.astype(np.float32), (1.0 / std).astype(np.float32)
+
+
+# Returns (mean, std) from scaler_stats.npz, or None if it needs rebuilding
+def read_scaler_stats():
+    if is_stale(SCALER_STATS_PATH, DATA_PATH):
+        return None
+    with np.load(SCALER_STATS_PATH) as stats:
+        if "version" not in stats.files or int(stats["version"]) != SCALER_STATS_VERSION:
+            return None
+        return stats["mean"], stats["std"]
+
+
+# Offline step (python route_classifier.py --export-scaler): compute the
+# per-column mean and population std the model was trained with, matching
+# StandardScaler. pandas is only needed here.
+def export_scaler_stats():
+    import pandas as pd
 
-try:
     # Load the data
-    df = pd.read_csv('Processed_crime.csv')
+    df = pd.read_csv(DATA_PATH)
 
     # Process training data
     train = df.iloc[:,:-1]
     if 'Unnamed: 0' in train.columns:
-        train.drop(columns=['Unnamed: 0'], inplace=True)
+        train = train.drop(columns=['Unnamed: 0'])
+
+    mean = train.mean().to_numpy().astype(np.float32)
+    std = train.std(ddof=0).to_numpy().astype(np.float32)
+    # Like StandardScaler, leave constant columns unscaled
+    std[std == 0] = 1.0
+    # Write then rename, so other sidecar workers never read a partial file
+    tmp_path = os.path.join(BASE_DIR, f"scaler_stats.{os.getpid()}.tmp.npz")
+    np.savez(tmp_path, version=SCALER_STATS_VERSION, mean=mean, std=std)
+    os.replace(tmp_path, SCALER_STATS_PATH)
+
+
+# Fused scaler transform: fills out[:, 0:2] with the scaled lat/lng and
+# out[:, 2:] with the scaled time features in a single pass
+def _scale_points_loop(lats, lngs, time_features, mean, inv_scale, out):
+    n_time = time_features.shape[0]
+    scaled_time = np.empty_like(time_features)
+    for j in range(n_time):
+        scaled_time[j] = (time_features[j] - mean[2 + j]) * inv_scale[2 + j]
+
+    for i in range(lats.shape[0]):
+        out[i, 0] = (lats[i] - mean[0]) * inv_scale[0]
+        out[i, 1] = (lngs[i] - mean[1]) * inv_scale[1]
+        for j in range(n_time):
+            out[i, 2 + j] = scaled_time[j]
+    return out
+
+
+def _scale_points_numpy(lats, lngs, time_features, mean, inv_scale, out):
+    out[:, 0] = (lats - mean[0]) * inv_scale[0]
+    out[:, 1] = (lngs - mean[1]) * inv_scale[1]
+    out[:, 2:] = (time_features - mean[2:]) * inv_scale[2:]
+    return out
 
-    # Create and fit the scaler
-    scaler = StandardScaler()
-    scaler.fit_transform(train)
 
-    # Load the model
-    with open("model.pkl", "rb") as f:
-        xgb_clf = pickle.load(f)
+# Without numba the loop would run in pure Python, so use NumPy instead
+if njit is not None:
+    scale_points = njit(cache=True, fastmath=True, nogil=True)(_scale_points_loop)
+else:
+    scale_points = _scale_points_numpy
 
-    # Read input data from stdin
-    input_data = sys.stdin.read()
-    data = json.loads(input_data)
 
-    # Initialize results list
-    results = []
+# Check a feature matrix with at least n rows out of the pool, growing it (at
+# least doubling) when a request has more points. Pair with release_feature_buffer.
+def acquire_feature_buffer(n):
+    try:
+        buffer = _scratch_pool.get_nowait()
+    except queue.Empty:
+        buffer = np.empty((SCRATCH_POINTS, 6), dtype=np.float32)
+    if n > len(buffer):
+        buffer = np.empty((max(n, 2 * len(buffer)), 6), dtype=np.float32)
+    return buffer
 
-    # Process each route
+
+def release_feature_buffer(buffer):
+    _scratch_pool.put(buffer)
+
+
+# Predict every point, reusing cached scores for points that fall in the
+# same ~100 m grid cell (3 decimals of lat/lng) and 5-minute time bucket.
+# Scores are cached per point rather than per route so overlapping routes
+# share hits; only the misses go through the model, still as one batch.
+def predict_points(lats, lngs, now):
+    time_key = (now.year, now.month, now.hour, now.minute // 5)
+    keys = [(lat, lng) + time_key
+            for lat, lng in zip(np.round(lats, 3).tolist(), np.round(lngs, 3).tolist())]
+
+    y_pred = np.empty(len(keys), dtype=np.float32)
+    misses = []
+    with _prediction_cache_lock:
+        for i, key in enumerate(keys):
+            score = _prediction_cache.get(key)
+            if score is None:
+                misses.append(i)
+            else:
+                _prediction_cache.move_to_end(key)
+                y_pred[i] = score
+
+    if not misses:
+        return y_pred
+
+    model = load_model()
+    mean, inv_scale = load_scaler_stats()
+
+    # Time features are the same for every point, so scale them once
+    time_features = np.array([now.year, now.month, now.hour, now.minute], dtype=np.float32)
+
+    # Feature matrix: LATITUDE, LONGITUDE, YEAR, MONTH, HOUR, MINUTE, filled
+    # into a pooled scratch buffer; predict returns a fresh array
+    buffer = acquire_feature_buffer(len(misses))
+    try:
+        features = buffer[:len(misses)]
+        scale_points(lats[misses], lngs[misses], time_features, mean, inv_scale, features)
+        miss_pred = predict(model, features)
+    finally:
+        release_feature_buffer(buffer)
+    y_pred[misses] = miss_pred
+
+    with _prediction_cache_lock:
+        for i, score in zip(misses, miss_pred.tolist()):
+            _prediction_cache[keys[i]] = score
+        while len(_prediction_cache) > PREDICTION_CACHE_SIZE:
+            _prediction_cache.popitem(last=False)
+
+    return y_pred
+
+
+def classify_routes(data):
+    # Get current date and time
+    now = datetime.now()
+
+    # Flatten every route into SoA lat/lng arrays so the model is called
+    # once per request instead of once per route
+    n_routes = len(data)
+    route_lens = np.zeros(n_routes, dtype=np.intp)
+    lat_parts = []
+    lng_parts = []
+    failed_routes = {}
     for route_idx, route in enumerate(data):
         try:
-            location_list = []
-            for point in route:
-                l = [float(point['lat']), float(point['lng'])]
-                location_list.append(l)
-
-            # Create DataFrame with proper column names
-            new_df = pd.DataFrame(location_list, columns=['LATITUDE', 'LONGITUDE'])
-            
-            # Add time features directly
-            new_df['YEAR'] = now.year
-            new_df['MONTH'] = now.month
-            new_df['HOUR'] = now.hour
-            new_df['MINUTE'] = now.minute
-            
-            # Transform the data
-            new_df_values = scaler.transform(new_df)
-            y_pred = xgb_clf.predict(new_df_values)
-            
-            # Debug output - examine actual prediction values
-            print(f"Debug - Route {route_idx}: y_pred values (first 5): {y_pred[:5]}", file=sys.stderr)
-            print(f"Debug - Route {route_idx}: y_pred sum: {np.sum(y_pred)}", file=sys.stderr)
-            print(f"Debug - Route {route_idx}: prediction count: {len(y_pred)}", file=sys.stderr)
-            
-            # Calculate score with high precision using Decimal
-            sum_val = Decimal(str(np.sum(y_pred)))
-            div = Decimal(str(len(y_pred) * 10))
-            score = sum_val / div
-            
-            # Debug the Decimal calculation
-            print(f"Debug - Route {route_idx}: sum_val={sum_val}, div={div}, score={score}", file=sys.stderr)
-            
-            # Convert to float for model compatibility but preserve precision
-            score_float = float(score)
-            
-            # Create a precise string representation
-            score_str = "{:.10f}".format(score_float).rstrip('0').rstrip('.')
-            
-            print(f"Raw score (high precision): {score_str}", file=sys.stderr)
-            
-            # TEMPORARY FIX: If score is very close to zero, use a test value
-            # This helps verify that the frontend is correctly handling non-zero values
-            if float(score_str) < 0.0001:
-                # Test values: route 0: 0.2, route 1: 0.5, route 2: 0.8
-                test_values = ["0.2", "0.5", "0.8"] 
-                score_str = test_values[route_idx % len(test_values)]
-                print(f"Using test value for route {route_idx}: {score_str}", file=sys.stderr)
-            
-            results.append(score_str)  # Store as string to preserve precision
-            
+            if not route:
+                raise ValueError("route has no points")
+            # Parsed JSON numbers are already floats; fromiter casts straight to float32
+            route_lats = np.fromiter((point['lat'] for point in route), dtype=np.float32, count=len(route))
+            route_lngs = np.fromiter((point['lng'] for point in route), dtype=np.float32, count=len(route))
         except Exception as route_error:
-            print(f"Error processing route {route_idx}: {str(route_error)}", file=sys.stderr)
-            results.append("0.5")  # Default score for error as string
-    
-    # Output the raw string array - no need for special encoding now
-    print(json.dumps(results))
-        
-except Exception as e:
-    print(f"Top-level exception: {str(e)}", file=sys.stderr)
-    print(json.dumps({"error": str(e)}))
-    sys.exit(1)
+            failed_routes[route_idx] = route_error
+            continue
+        lat_parts.append(route_lats)
+        lng_parts.append(route_lngs)
+        route_lens[route_idx] = len(route)
+
+    # Routes that failed to parse keep the default score
+    scores = np.full(n_routes, DEFAULT_SCORE, dtype=np.float32)
+    for route_idx, route_error in failed_routes.items():
+        logger.warning("Error processing route %d: %s", route_idx, route_error)
+
+    if lat_parts:
+        y_pred = predict_points(np.concatenate(lat_parts), np.concatenate(lng_parts), now)
+
+        # Per-route mean prediction scaled to 0-1, in one vectorized pass
+        route_ids = np.repeat(np.arange(n_routes), route_lens)
+        sums = np.bincount(route_ids, weights=y_pred, minlength=n_routes).astype(np.float32)
+        valid = route_lens > 0
+
+        # Keep scores strictly positive so the frontend never sees a bare zero
+        scores[valid] = np.maximum(sums[valid] / (route_lens[valid].astype(np.float32) * 10.0), MIN_SCORE)
+
+        # Formatting prediction arrays is costly, so only do it when debugging
+        if logger.isEnabledFor(logging.DEBUG):
+            offsets = np.concatenate(([0], np.cumsum(route_lens)))
+            for route_idx in np.flatnonzero(valid):
+                route_pred = y_pred[offsets[route_idx]:offsets[route_idx + 1]]
+                logger.debug("Route %d: y_pred values (first 5): %s, sum: %s, count: %d, score: %s",
+                             route_idx, route_pred[:5], sums[route_idx], route_lens[route_idx], scores[route_idx])
+
+    # 4 decimals is well within float32 prediction precision; round in float64
+    # so the JSON carries the short decimal rather than float32 noise
+    return scores.astype(np.float64).round(4).tolist()
+
+
+# orjson parses lat/lng-heavy payloads straight to floats and serializes
+# responses to bytes, both much faster than json
+if orjson is not None:
+    parse_json = orjson.loads
+    dump_json = orjson.dumps
+else:
+    parse_json = json.loads
+
+    def dump_json(payload):
+        return json.dumps(payload).encode()
+
+
+# index.js runs several sidecar processes on the same port for concurrency
+# (cache-key building and the cache walk hold the GIL). With SO_REUSEPORT
+# the kernel spreads connections across them.
+class ClassifierServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        if hasattr(socket, "SO_REUSEPORT"):
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+# Sidecar HTTP handler: POST /classify with a JSON array of routes returns a
+# JSON array of scores. Model and scaler stay loaded between requests.
+class ClassifyHandler(BaseHTTPRequestHandler):
+    # Keep-alive lets index.js reuse its localhost connection
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        # Always consume the body, even for errors, so the next request on a
+        # keep-alive connection starts at the right byte
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        # read(-1) would block until the client closes the connection
+        if length < 0:
+            self.close_connection = True
+            self.send_json(400, {"error": "Invalid Content-Length"})
+            return
+        body = self.rfile.read(length)
+
+        if self.path != "/classify":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            data = parse_json(body)
+            self.send_json(200, classify_routes(data))
+        except Exception as e:
+            logger.exception("Top-level exception: %s", e)
+            self.send_json(500, {"error": str(e)})
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "Not found"})
+            return
+        self.send_json(200, {"status": "up"})
+
+    def send_json(self, status, payload):
+        body = dump_json(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Skip the default per-request access log on stderr
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("CLASSIFIER_LOG_LEVEL", "WARNING").upper(),
+                        format="%(levelname)s %(message)s")
+
+    # Offline export steps
+    if sys.argv[1:] == ["--export-scaler"]:
+        export_scaler_stats()
+        sys.exit(0)
+    if sys.argv[1:] == ["--export-lib"]:
+        export_compiled_model()
+        sys.exit(0)
+
+    try:
+        load_model()
+        mean, inv_scale = load_scaler_stats()
+
+        # Compile (or load from cache) the scaling kernel before the first request
+        scale_points(np.zeros(1, dtype=np.float32), np.zeros(1, dtype=np.float32),
+                     np.zeros(4, dtype=np.float32), mean, inv_scale, np.empty((1, 6), dtype=np.float32))
+    except Exception as e:
+        logger.exception("Top-level exception: %s", e)
+        sys.exit(1)
+
+    server = ClassifierServer((HOST, PORT), ClassifyHandler)
+    print(f"Classifier running on http://{HOST}:{PORT}/classify", flush=True)
+    server.serve_forever()